@@ -1,19 +1,21 @@
 """
-Install https://github.com/martini-alessandro/Maximum-Entropy-Spectrum
-This script loads an audio file and it computes its PSD.
+This script loads an audio file and it computes its PSD with the Maximum
+Entropy Spectral Analysis of https://github.com/martini-alessandro/Maximum-Entropy-Spectrum
+(Burg recursion with FPE order selection, compiled in sound_kernels.py).
 
 Loudness can be normalized according to EBU R128, positive values are accepted
 but not recommended.
 """
 import argparse
 import numpy as np
+import matplotlib
 import matplotlib.pyplot as plt
+from matplotlib import font_manager
+from scipy.fft import rfft, next_fast_len
 # https://python-soundfile.readthedocs.io/en/0.11.0/
 sfreq = "0.11.0"
 import soundfile as sf
-import pyloudnorm as pyln
-from memspectrum import MESA
-import memspectrum.GenerateTimeSeries as GenerateTimeSeries
+from sound_kernels import ar_psd, burg_numba, integrated_loudness, minmax_idx, yule_walker
 from packaging import version
 import sys
 
@@ -38,6 +40,10 @@ parser.add_argument('--rateend', type=int, default=0,
                     help='End frequency for analysis, 0 means Nyquist (default: 0)')
 parser.add_argument('--normalize', type=float, 
                     help='Target loudness in LUFS for normalization (optional)')
+parser.add_argument('--method', choices=['burg', 'yw'], default='burg',
+                    help='AR estimator: Burg (MESA) or the faster, lower dynamic range Yule-Walker (default: burg)')
+parser.add_argument('--out', type=str, metavar='PNG',
+                    help='Save the plot to this file instead of showing it (no GUI needed)')
 
 args = parser.parse_args()
 
@@ -48,25 +54,47 @@ logfreq = args.logfreq
 ratestart = args.ratestart
 rateend = args.rateend
 target_loudness = args.normalize
+method = args.method
 
+if args.out:
+    # Rendering straight to a file, skip GUI backend initialization
+    matplotlib.use('Agg')
 plt.rcParams.update({'font.size': 10})
-plt.rcParams['font.family'] = 'Iosevka SS08'
+try:
+    font_manager.findfont('Iosevka SS08', fallback_to_default=False)
+    plt.rcParams['font.family'] = 'Iosevka SS08'
+except ValueError:
+    plt.rcParams['font.family'] = 'DejaVu Sans'
 plt.rcParams['figure.dpi'] = 300
 
 if verbose:
     print(sf.info(fname))
 # Loading data and preparing input to MESA
-data, realrate = sf.read(fname, always_2d=True)
+with sf.SoundFile(fname) as sndfile:
+    realrate = sndfile.samplerate
+    data = sndfile.read(dtype='float32', always_2d=True)
 if rateend == 0:
     rateend = int(realrate / 2)
+if not 0 <= ratestart < rateend <= realrate / 2:
+    sys.stderr.write(f"Error: analysis range must satisfy 0 <= ratestart < rateend <= Nyquist ({realrate / 2} Hz), got {ratestart}-{rateend}.\n")
+    sys.exit(1)
 
 # Loudness normalization to EBU R128 if specified
 if target_loudness is not None:
-    meter = pyln.Meter(realrate)  # create BS.1770 meter
-    loudness = meter.integrated_loudness(data)
+    loudness = integrated_loudness(data, realrate)
     print(f"Integrated loudness before normalization: {loudness} LUFS")
-    normalized_audio = pyln.normalize.loudness(data, loudness, target_loudness)
-    normalized_loudness = meter.integrated_loudness(normalized_audio)
+    if not np.isfinite(loudness):
+        sys.stderr.write("Error: the audio is silent after gating, it cannot be loudness normalized.\n")
+        sys.exit(1)
+    normalized_audio = data * np.float32(10. ** ((target_loudness - loudness) / 20.))
+    if np.max(np.abs(normalized_audio)) >= 1.0:
+        sys.stderr.write("Warning: possible clipped samples after normalization.\n")
+    # Normalization is a plain gain, so the result is the target by construction;
+    # only re-measure it when asked to be verbose
+    if verbose:
+        normalized_loudness = integrated_loudness(normalized_audio, realrate)
+    else:
+        normalized_loudness = target_loudness
     print(f"Integrated loudness after normalization: {normalized_loudness} LUFS")
 else:
     normalized_audio = data
@@ -74,21 +102,48 @@ else:
 # Calculate the length of the audio file in seconds
 t = normalized_audio.shape[0] / realrate  # Total samples divided by sample rate
 print(f"Processing \"{fname}\", length {t} seconds, data Nyquist freq {realrate / 2}, Analysis freq {ratestart}-{rateend}")
-data_MESA = normalized_audio[:int(t * realrate), 0].astype(np.float64)
+data_MESA = np.ascontiguousarray(normalized_audio[:, 0], dtype=np.float64)
 dt = 1. / realrate
 
-# Computing PSD with MESA
-M = MESA()
-P, ak, opt = M.solve(data_MESA, method="Standard", optimisation_method="FPE",
-                     m=int(2 * len(data_MESA) / (2 * np.log(len(data_MESA)))))
+# Fitting the AR model: MESA's Standard Burg recursion (or Yule-Walker) with FPE
+m = int(2 * len(data_MESA) / (2 * np.log(len(data_MESA))))
+try:
+    if method == 'yw':
+        P, ak, opt = yule_walker(data_MESA, m)
+    else:
+        P, ak, opt = burg_numba(data_MESA, m)
+except ValueError as e:
+    sys.stderr.write(f"Error: channel 0 of \"{fname}\": {e}.\n")
+    sys.exit(1)
 
 # Evaluating the spectrum
 N_points = 1000000
-f_PSD = np.linspace(ratestart, rateend, N_points)
-PSD = M.spectrum(dt, f_PSD)
+if logfreq:
+    # Log-spaced frequencies are not on an FFT grid, evaluate A(f) at each one
+    f_PSD = np.geomspace(max(ratestart, 1. / (len(data_MESA) * dt)), rateend, N_points)
+    PSD = ar_psd(ak, P, dt, f_PSD)
+else:
+    # Uniform grid: one zero-padded rFFT of the AR coefficients gives 1/|A(f)|^2
+    Nfft = next_fast_len(max(2 * N_points, len(ak)), real=True)
+    H = rfft(ak, n=Nfft)
+    i0, i1 = int(np.ceil(ratestart * Nfft * dt)), min(int(rateend * Nfft * dt) + 1, len(H))
+    f_PSD = np.arange(i0, i1) / (Nfft * dt)
+    PSD = np.abs(H[i0:i1])
+    np.square(PSD, out=PSD)
+    np.divide(P * dt, PSD, out=PSD)
 
 fig, ax = plt.subplots(1, sharex=True)
-plt.plot(f_PSD, PSD.real)
+# The figure cannot show more than one min/max pair per horizontal pixel,
+# so plot the PSD envelope per pixel column instead of every point
+nbin = int(fig.get_size_inches()[0] * fig.dpi)
+if len(PSD) > 2 * nbin:
+    edges = np.linspace(0, len(PSD), nbin + 1).astype(int)
+    f_mid = (f_PSD[edges[:-1]] + f_PSD[edges[1:] - 1]) / 2
+    PSD_min = np.minimum.reduceat(PSD, edges[:-1])
+    PSD_max = np.maximum.reduceat(PSD, edges[:-1])
+    plt.plot(np.repeat(f_mid, 2), np.column_stack((PSD_min, PSD_max)).ravel())
+else:
+    plt.plot(f_PSD, PSD)
 plt.yscale('log')
 plt.ylabel('PSD')
 if logfreq:
@@ -96,17 +151,19 @@ if logfreq:
 plt.xlabel("frequency (Hz)")
 
 # Find min and max PSD values
-min_idx_y = np.argmin(PSD.real)
-max_idx_y = np.argmax(PSD.real)
+min_idx_y, max_idx_y = minmax_idx(PSD)
 print(f"Max frequency {f_PSD[max_idx_y]:.2f} Hz")
 
 # Scatter points for min and max
-plt.scatter(f_PSD[max_idx_y], PSD.real[max_idx_y], color='red',
-            label=f'Max: {PSD.real[max_idx_y]:.4e} @{f_PSD[max_idx_y]:.4f}Hz', s=15)
-plt.scatter(f_PSD[min_idx_y], PSD.real[min_idx_y], color='green',
-            label=f'Min: {PSD.real[min_idx_y]:.4e} @{f_PSD[min_idx_y]:.4f}Hz', s=15)
+plt.scatter(f_PSD[max_idx_y], PSD[max_idx_y], color='red',
+            label=f'Max: {PSD[max_idx_y]:.4e} @{f_PSD[max_idx_y]:.4f}Hz', s=15)
+plt.scatter(f_PSD[min_idx_y], PSD[min_idx_y], color='green',
+            label=f'Min: {PSD[min_idx_y]:.4e} @{f_PSD[min_idx_y]:.4f}Hz', s=15)
 
 plt.title(fname)
 plt.tight_layout()  # Automatically adjusts borders
 plt.legend()
-plt.show()
+if args.out:
+    plt.savefig(args.out)
+else:
+    plt.show()
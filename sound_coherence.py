@@ -1,10 +1,22 @@
 import argparse
+import contextlib
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import matplotlib
 import matplotlib.pyplot as plt
+from matplotlib import font_manager
 import soundfile as sf
 from scipy import signal
+from scipy.fft import next_fast_len, set_backend, set_workers
 import sys
 from packaging import version
+from sound_kernels import minmax_idx
+try:
+    import pyfftw
+    from pyfftw.interfaces import scipy_fft as pyfftw_backend
+except ImportError:
+    pyfftw = None
 
 # Check SoundFile version
 sfreq = "0.11.0"
@@ -23,6 +35,7 @@ parser.add_argument('--nperseg', type=int, default=1024, help='Length of each se
 parser.add_argument('--verbose', action='store_true', help='Show verbose information about the audio file')
 parser.add_argument('--ratestart', type=int, default=0, help='Start frequency for analysis (default: 0)')
 parser.add_argument('--rateend', type=int, default=0, help='End frequency for analysis, 0 means Nyquist (default: 0)')
+parser.add_argument('--out', type=str, metavar='PNG', help='Save the plot to this file instead of showing it (no GUI needed)')
 args = parser.parse_args()
 
 # Extract arguments
@@ -36,15 +49,24 @@ if nperseg < 8:
     print(f'nperseg should be >= 8')
     exit(1)
 
+if args.out:
+    # Rendering straight to a file, skip GUI backend initialization
+    matplotlib.use('Agg')
 plt.rcParams.update({'font.size': 10})
-plt.rcParams['font.family'] = 'Iosevka SS08'
+try:
+    font_manager.findfont('Iosevka SS08', fallback_to_default=False)
+    plt.rcParams['font.family'] = 'Iosevka SS08'
+except ValueError:
+    plt.rcParams['font.family'] = 'DejaVu Sans'
 plt.rcParams['figure.dpi'] = 300
 
 if verbose:
     print(sf.info(fname))
 
 # Loading data and preparing input to MESA
-data, realrate = sf.read(fname, always_2d=False)
+with sf.SoundFile(fname) as sndfile:
+    realrate = sndfile.samplerate
+    data = sndfile.read(dtype='float32', always_2d=False)
 if rateend == 0:
     rateend = int(realrate / 2)
 
@@ -58,11 +80,43 @@ if data.ndim == 1 or data.shape[1] < 2:
     sys.exit(1)
 
 # Extract the first and second channels
-channel_1 = data[:int(t * realrate), 0].astype(np.float64)
-channel_2 = data[:int(t * realrate), 1].astype(np.float64)
-
-# Estimate the magnitude squared coherence estimate
-f, Cxy = signal.coherence(channel_1, channel_2, fs=realrate, nperseg=nperseg, window=window)
+channel_1 = np.ascontiguousarray(data[:, 0])
+channel_2 = np.ascontiguousarray(data[:, 1])
+
+# Estimate the magnitude squared coherence estimate from the auto and cross spectra
+# Like scipy does for a window name, shorten the segments to the signal length
+nperseg = min(nperseg, len(channel_1))
+nfft = next_fast_len(nperseg, real=True)
+# Build the window once and share it between the spectra
+win = signal.get_window(window, nperseg)
+if pyfftw is not None:
+    # FFTW plans are cached and reused for the equally sized Welch segments
+    pyfftw.interfaces.cache.enable()
+    pyfftw.interfaces.cache.set_keepalive_time(60)
+
+
+# The three spectra are independent and NumPy/scipy.fft release the GIL, run them
+# side by side with the cores split between them (one at a time on a single core)
+ncpu = os.cpu_count() or 1
+ntasks = min(3, ncpu)
+fft_workers = ncpu // ntasks
+
+
+def spectrum(estimate, *channels):
+    # The FFT backend and worker count are thread-local, set them up per task
+    fft_backend = set_backend(pyfftw_backend, only=True) if pyfftw is not None else contextlib.nullcontext()
+    with fft_backend, set_workers(fft_workers):
+        return estimate(*channels, fs=realrate, nperseg=nperseg, window=win, nfft=nfft)
+
+
+with ThreadPoolExecutor(max_workers=ntasks) as ex:
+    xx = ex.submit(spectrum, signal.welch, channel_1)
+    yy = ex.submit(spectrum, signal.welch, channel_2)
+    xy = ex.submit(spectrum, signal.csd, channel_1, channel_2)
+    f, Pxx = xx.result()
+    _, Pyy = yy.result()
+    _, Pxy = xy.result()
+Cxy = np.abs(Pxy) ** 2 / (Pxx * Pyy)
 
 # Filter frequencies and coherence values to the specified range
 mask = (f >= ratestart) & (f <= rateend)
@@ -70,8 +124,7 @@ f_filtered = f[mask]
 Pxy_filtered = Cxy[mask]
 
 # Find min and max values within the filtered range
-min_idx_y = np.argmin(Pxy_filtered)
-max_idx_y = np.argmax(Pxy_filtered)
+min_idx_y, max_idx_y = minmax_idx(Pxy_filtered)
 min_val = Pxy_filtered[min_idx_y]
 max_val = Pxy_filtered[max_idx_y]
 min_freq = f_filtered[min_idx_y]
@@ -99,5 +152,7 @@ min_label = f'Min {min_val:.3f}@{min_freq:.2f}Hz'
 max_label = f'Max {max_val:.3f}@{max_freq:.2f}Hz'
 plt.legend([f'Coherence {ratestart}–{rateend} Hz', min_label, max_label], loc='best')
 
-plt.show()
-
+if args.out:
+    plt.savefig(args.out)
+else:
+    plt.show()
@@ -0,0 +1,289 @@
+"""
+Numba kernels shared by the sound_* scripts, and the small helpers that
+drive them.
+
+The first call of each kernel compiles it, compiled code is cached next to
+this file so later runs start quickly.
+"""
+import numpy as np
+from numba import njit, prange
+from scipy.signal import correlate
+
+
+@njit(cache=True)
+def _step_up(k, p):
+    """
+    Levinson step-up: the a_k of order p from the first p reflection
+    coefficients k.
+    """
+    a = np.zeros(p + 1)
+    a[0] = 1.
+    for q in range(p):
+        kq = k[q]
+        for j in range((q + 3) // 2):
+            lo = a[j]
+            hi = a[q + 1 - j]
+            a[j] = lo + kq * hi
+            if q + 1 - j != j:
+                a[q + 1 - j] = hi + kq * lo
+    return a
+
+
+@njit(cache=True, fastmath=True, boundscheck=False)
+def burg_numba(x, m):
+    """
+    Burg recursion with FPE order selection, following memspectrum's
+    MESA.solve(method="Standard", optimisation_method="FPE").
+
+    Everything runs in float64 whatever the dtype of x: in float32 a clean
+    tone drives |k| to 1 within a couple of orders, P collapses to 0 and
+    the FPE selection breaks down.
+    Returns P, a_k and the FPE value of every order that was evaluated.
+    """
+    N = x.size
+    ef = x.astype(np.float64)  # forward prediction error
+    eb = ef.copy()  # backward prediction error
+    P = np.empty(m + 1)
+    P[0] = np.var(ef)
+    k = np.empty(m)
+    opt = np.empty(m)
+    early_stop_step = 100
+    idx = 0
+    old_idx = 0
+    n = N  # valid length of ef and eb
+    it = 0
+    num = 0.
+    den = 0.
+    for j in range(n - 1):
+        f = ef[j + 1]
+        b = eb[j]
+        num += f * b
+        den += f * f + b * b
+    if den == 0.:
+        raise ValueError("the signal is silent, there is no spectrum to estimate")
+    for i in range(m):
+        if den == 0.:
+            # The errors vanished, the signal is perfectly predicted by the
+            # orders so far: choose among those
+            idx = np.argmin(opt[:it])
+            break
+        k[i] = -2. * num / den
+        ki = k[i]
+        # ef[j] <- ef[j+1] + k eb[j], eb[j] <- eb[j] + k ef[j+1], in place.
+        # The sums of the next order only need the freshly updated values,
+        # so they are accumulated in the same pass over the buffers.
+        f = ef[1]
+        b = eb[0]
+        ef[0] = f + ki * b
+        eb[0] = b + ki * f
+        prev_b = eb[0]
+        num = 0.
+        den = 0.
+        for j in range(1, n - 1):
+            f = ef[j + 1]
+            b = eb[j]
+            nf = f + ki * b
+            nb = b + ki * f
+            ef[j] = nf
+            eb[j] = nb
+            num += nf * prev_b
+            den += nf * nf + prev_b * prev_b
+            prev_b = nb
+        n -= 1
+        P[i + 1] = P[i] * (1. - ki * ki)
+        opt[i] = P[i + 1] * (N + i + 2) / (N - i - 2)
+        it = i + 1
+        # FPE at order m needs every reflection coefficient up to m, so the
+        # orders cannot be bisected; instead stop once the minimum has not
+        # improved by 1% in the last 100 orders
+        if (i % early_stop_step == 0 and i != 0) or i >= m - 1:
+            idx = np.argmin(opt[:it])
+            if old_idx < idx and opt[idx] * 1.01 < opt[old_idx]:
+                old_idx = idx
+            else:
+                break
+
+    return P[idx], _step_up(k, idx), opt[:it]
+
+
+@njit(cache=True, fastmath=True)
+def _levinson_fpe(r, N, m):
+    """
+    Levinson-Durbin recursion on the autocorrelation r with the same FPE
+    early stop as burg_numba(). opt[i] is the FPE of order i + 1, and unlike
+    memspectrum's Burg the model of that minimizing order is returned.
+    """
+    P = np.empty(m + 1)
+    P[0] = r[0]
+    a = np.zeros(m + 1)
+    a[0] = 1.
+    k = np.empty(m)
+    opt = np.empty(m)
+    early_stop_step = 100
+    idx = 0
+    old_idx = 0
+    it = 0
+    for i in range(m):
+        acc = 0.
+        for j in range(i + 1):
+            acc += a[j] * r[i + 1 - j]
+        ki = -acc / P[i]
+        k[i] = ki
+        for j in range((i + 3) // 2):
+            lo = a[j]
+            hi = a[i + 1 - j]
+            a[j] = lo + ki * hi
+            if i + 1 - j != j:
+                a[i + 1 - j] = hi + ki * lo
+        P[i + 1] = P[i] * (1. - ki * ki)
+        opt[i] = P[i + 1] * (N + i + 2) / (N - i - 2)
+        it = i + 1
+        if (i % early_stop_step == 0 and i != 0) or i >= m - 1:
+            idx = np.argmin(opt[:it])
+            if old_idx < idx and opt[idx] * 1.01 < opt[old_idx]:
+                old_idx = idx
+            else:
+                break
+
+    return P[idx + 1], _step_up(k, idx + 1), opt[:it]
+
+
+def yule_walker(x, m):
+    """
+    Yule-Walker AR fit with FPE order selection, returning P, a_k and FPE
+    values like burg_numba(). Needs only the biased autocorrelation,
+    from one FFT, plus an O(order^2) recursion instead of O(N * order).
+    """
+    N = x.size
+    x = x.astype(np.float64)
+    r = correlate(x, x, mode='full', method='fft')[N - 1:N + m] / N
+    if r[0] == 0.:
+        raise ValueError("the signal is silent, there is no spectrum to estimate")
+    return _levinson_fpe(r, N, m)
+
+
+@njit(cache=True, parallel=True, fastmath=True)
+def ar_psd(ak, P, dt, f):
+    """
+    PSD of the AR model, P dt / |A(f)|^2, at arbitrary frequencies f.
+    A is evaluated with Horner's scheme, frequencies are spread over cores.
+    """
+    out = np.empty(f.size)
+    for i in prange(f.size):
+        z = np.exp(-2j * np.pi * f[i] * dt)
+        acc = ak[-1] + 0j
+        for k in range(ak.size - 2, -1, -1):
+            acc = acc * z + ak[k]
+        out[i] = P * dt / (acc.real * acc.real + acc.imag * acc.imag)
+    return out
+
+
+@njit(cache=True)
+def minmax_idx(a):
+    """
+    Indices of the first minimum and first maximum of a, in a single pass.
+    """
+    if a.size == 0:
+        raise ValueError("attempt to get argmin/argmax of an empty sequence")
+    lo = hi = a[0]
+    lo_i = hi_i = 0
+    for i in range(1, a.size):
+        v = a[i]
+        if v < lo:
+            lo = v
+            lo_i = i
+        elif v > hi:
+            hi = v
+            hi_i = i
+    return lo_i, hi_i
+
+
+def _k_weighting(rate):
+    """
+    Coefficients of the two K-weighting biquads of ITU-R BS.1770 (high shelf
+    and high pass) for the given sample rate, designed as pyloudnorm does.
+    Returns b and a with one row per stage, normalized to a0 = 1.
+    """
+    # High shelf: G = 4 dB, Q = 1/sqrt(2), fc = 1500 Hz
+    A = 10 ** (4. / 40.)
+    w0 = 2. * np.pi * 1500. / rate
+    alpha = np.sin(w0) * np.sqrt(2) / 2.
+    cw, sA = np.cos(w0), np.sqrt(A)
+    shelf_b = [A * ((A + 1) + (A - 1) * cw + 2 * sA * alpha),
+               -2 * A * ((A - 1) + (A + 1) * cw),
+               A * ((A + 1) + (A - 1) * cw - 2 * sA * alpha)]
+    shelf_a = [(A + 1) - (A - 1) * cw + 2 * sA * alpha,
+               2 * ((A - 1) - (A + 1) * cw),
+               (A + 1) - (A - 1) * cw - 2 * sA * alpha]
+    # High pass: Q = 0.5, fc = 38 Hz
+    w0 = 2. * np.pi * 38. / rate
+    alpha = np.sin(w0)
+    cw = np.cos(w0)
+    hp_b = [(1 + cw) / 2, -(1 + cw), (1 + cw) / 2]
+    hp_a = [1 + alpha, -2 * cw, 1 - alpha]
+    b = np.array([shelf_b, hp_b])
+    a = np.array([shelf_a, hp_a])
+    return b / a[:, :1], a / a[:, :1]
+
+
+@njit(cache=True, fastmath=True)
+def _k_weighted_power(x, b, a, lo, hi):
+    """
+    K-weight every channel of x (samples, channels) with the biquad cascade
+    b, a (direct form II transposed) and return the energy of each block
+    x[lo[j]:hi[j]], shape (channels, blocks).
+    """
+    n, nch = x.shape
+    y = np.empty(n)
+    z = np.zeros((nch, lo.size))
+    for ch in range(nch):
+        for i in range(n):
+            y[i] = x[i, ch]
+        for s in range(b.shape[0]):
+            b0, b1, b2 = b[s, 0], b[s, 1], b[s, 2]
+            a1, a2 = a[s, 1], a[s, 2]
+            z1 = 0.
+            z2 = 0.
+            for i in range(n):
+                v = y[i]
+                w = b0 * v + z1
+                z1 = b1 * v - a1 * w + z2
+                z2 = b2 * v - a2 * w
+                y[i] = w
+        for j in range(lo.size):
+            acc = 0.
+            for i in range(lo[j], hi[j]):
+                acc += y[i] * y[i]
+            z[ch, j] = acc
+    return z
+
+
+def integrated_loudness(data, rate, block_size=0.400, overlap=0.75):
+    """
+    Integrated gated loudness in LUFS of data (samples, channels) as defined
+    by ITU-R BS.1770-4, matching pyloudnorm's Meter.integrated_loudness().
+    """
+    if data.ndim == 1:
+        data = data[:, np.newaxis]
+    if data.shape[1] > 5:
+        raise ValueError("Audio must have five channels or less.")
+    if data.shape[0] < block_size * rate:
+        raise ValueError("Audio must have length greater than the block size.")
+
+    G = np.array([1.0, 1.0, 1.0, 1.41, 1.41])[:data.shape[1]]  # channel gains
+    Gamma_a = -70.0  # absolute gate in LUFS
+    step = 1.0 - overlap
+    T = data.shape[0] / rate
+    j = np.arange(int(np.round((T - block_size) / (block_size * step))) + 1)
+    lo = (block_size * (j * step) * rate).astype(np.int64)
+    hi = (block_size * (j * step + 1) * rate).astype(np.int64)
+    b, a = _k_weighting(rate)
+    z = _k_weighted_power(data, b, a, lo, hi) / (block_size * rate)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        l = -0.691 + 10.0 * np.log10(G @ z)
+        J_g = l >= Gamma_a
+        Gamma_r = -0.691 + 10.0 * np.log10(G @ z[:, J_g].sum(axis=1) / J_g.sum()) - 10.0
+        J_g = (l > Gamma_r) & (l > Gamma_a)
+        z_avg_gated = np.nan_to_num(z[:, J_g].sum(axis=1) / J_g.sum())
+        return -0.691 + 10.0 * np.log10(G @ z_avg_gated)